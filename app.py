@@ -1,12 +1,19 @@
+import hashlib
 import os
+import shutil
 import sqlite3
+import tempfile
 import time
 import json
-import urllib.request
-import urllib.error
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import product
 from urllib.parse import urlencode
 
-from flask import Flask, render_template, request, jsonify, abort
+import urllib3
+
+from flask import Flask, render_template, request, jsonify, abort, g, make_response
 
 # =========================================================
 # Config
@@ -23,8 +30,62 @@ SDF2D_DIR = os.path.join(STRUCT_BASE, "sdf2d")
 SDF3D_DIR = os.path.join(STRUCT_BASE, "sdf3d")
 PNG_DIR = os.path.join(STRUCT_BASE, "png")
 
+# ETag / Last-Modified of downloaded structure files (kept out of /static: not public)
+VALIDATORS_DIR = os.path.join(BASE_DIR, "data", "download_validators")
+
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) SpicesDB/1.0"
 
+# ✅ Applied once per connection (WAL persists on the DB file itself)
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA busy_timeout=5000",
+)
+
+# ✅ PubChem HTTP: one pooled client (keep-alive, reused TLS) + worker pools.
+# Detail-page fetches get their own small pool so they never queue behind an admin batch.
+DOWNLOAD_WORKERS = 8
+ONDEMAND_WORKERS = 3
+HTTP = urllib3.PoolManager(
+    maxsize=DOWNLOAD_WORKERS + ONDEMAND_WORKERS,
+    headers={"User-Agent": USER_AGENT},
+    retries=False,
+)
+DOWNLOAD_POOL = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS, thread_name_prefix="pubchem")
+ONDEMAND_POOL = ThreadPoolExecutor(max_workers=ONDEMAND_WORKERS, thread_name_prefix="pubchem-page")
+
+# ✅ PubChem asks for <= 5 requests/second; counted per HTTP call, shared by all threads
+PUBCHEM_RATE = 5.0
+PUBCHEM_BURST = 5
+
+
+class TokenBucket:
+    """Thread-safe token bucket: acquire() blocks until a token is available."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            # Reserve a token (possibly going negative) and sleep off the debt outside the lock
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+
+
+PUBCHEM_LIMITER = TokenBucket(PUBCHEM_RATE, PUBCHEM_BURST)
+
 app = Flask(__name__)
 
 # =========================================================
@@ -42,32 +103,200 @@ def get_db_connection():
         raise FileNotFoundError(
             f"SQLite DB not found at {DB_PATH}. Put spices.db inside /data folder."
         )
-    conn = sqlite3.connect(DB_PATH)
+    # larger statement cache: hot SQL below is kept as module constants so the
+    # text (the cache key) is identical on every call and skips re-parsing
+    conn = sqlite3.connect(DB_PATH, cached_statements=256)
     conn.row_factory = sqlite3.Row
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
 
+def get_db():
+    """
+    Request-scoped connection stored on flask.g.
+    Opened on first use, closed by close_db() on app-context teardown.
+    """
+    if "db" not in g:
+        g.db = get_db_connection()
+    return g.db
+
+
+@app.teardown_appcontext
+def close_db(exc=None):
+    conn = g.pop("db", None)
+    if conn is not None:
+        conn.close()
+
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+@app.before_request
+def ensure_schema_once():
+    """Startup-only: run the schema/index guard on the first request of each process."""
+    global _schema_ready
+    if _schema_ready or request.endpoint == "static":
+        return
+    with _schema_lock:
+        if not _schema_ready:
+            ensure_descriptors_table_schema()
+            _schema_ready = True
+
+
 def query_db(sql: str, params=(), one: bool = False):
-    conn = get_db_connection()
-    cur = conn.execute(sql, params)
-    rows = cur.fetchall()
-    conn.close()
+    rows = get_db().execute(sql, params).fetchall()
     return (rows[0] if rows else None) if one else rows
 
 
+# Browse pagination bounds
+PER_PAGE_DEFAULT = 25
+PER_PAGE_MIN = 5
+PER_PAGE_MAX = 200
+
+
+def page_args() -> tuple[int, int, int]:
+    """(page, per_page, offset) from the querystring, per_page clamped to PER_PAGE_MIN..MAX."""
+    page = int(request.args.get("page", 1))
+    per_page = int(request.args.get("per_page", PER_PAGE_DEFAULT))
+    per_page = max(PER_PAGE_MIN, min(per_page, PER_PAGE_MAX))
+    return page, per_page, (page - 1) * per_page
+
+
+def page_total(rows, offset: int, count_sql: str, params=()) -> int:
+    """
+    Total matches for a browse page whose SELECT carries COUNT(*) OVER () AS total_count.
+    Only a page past the end (no rows, nothing to read it from) runs count_sql.
+    """
+    if rows:
+        return rows[0]["total_count"]
+    if offset <= 0:
+        return 0
+    return query_db(count_sql, params, one=True)["c"]
+
+
 def build_base_qs():
-    """Build querystring without 'page' so pagination can append page=<n>."""
-    args = request.args.to_dict(flat=True)
-    args.pop("page", None)
-    return urlencode(args)
+    """
+    Build querystring without 'page' so pagination can append page=<n>.
+    Computed once per request (cached on flask.g).
+    """
+    if "base_qs" not in g:
+        args = request.args.copy()
+        args.poplist("page")
+        g.base_qs = urlencode(list(args.items(multi=True)))
+    return g.base_qs
+
+
+# Secondary indexes for the browse/detail joins and name filters.
+# structures.phyto_id, phytochemicals.cid and spice_phytochemicals(spice_id, phyto_id)
+# are already indexed by their UNIQUE / PRIMARY KEY constraints.
+DB_INDEXES = {
+    "idx_sp_phyto": "CREATE INDEX IF NOT EXISTS idx_sp_phyto ON spice_phytochemicals(phyto_id)",
+    "idx_phyto_name_nocase": "CREATE INDEX IF NOT EXISTS idx_phyto_name_nocase ON phytochemicals(phyto_name COLLATE NOCASE)",
+    "idx_spice_name_nocase": "CREATE INDEX IF NOT EXISTS idx_spice_name_nocase ON spices(spice_name COLLATE NOCASE)",
+}
+
+
+# One shared phytochemical+structures source for every page (a missing structures
+# row reads as has_2d = has_3d = 0 with NULL paths).
+V_PHYTO_SQL = """
+CREATE VIEW IF NOT EXISTS v_phyto AS
+SELECT p.phyto_id, p.phyto_name, p.cid,
+       COALESCE(s.has_2d, 0) AS has_2d,
+       COALESCE(s.has_3d, 0) AS has_3d,
+       s.sdf_2d_path, s.sdf_3d_path, s.png_2d_path
+FROM phytochemicals p
+LEFT JOIN structures s ON s.phyto_id = p.phyto_id
+"""
+# sqlite_master keeps the CREATE text minus "IF NOT EXISTS"
+V_PHYTO_STORED_SQL = V_PHYTO_SQL.strip().replace(" IF NOT EXISTS", "", 1)
+
+
+# Infix name search: FTS5 trigram indexes kept in sync with the base tables by triggers.
+# (table, fts table, rowid column, name column)
+NAME_SEARCH_TABLES = (
+    ("phytochemicals", "phyto_fts", "phyto_id", "phyto_name"),
+    ("spices", "spice_fts", "spice_id", "spice_name"),
+)
+FTS_MIN_QUERY = 3  # trigram needs at least 3 characters to match anything
+
+# set by ensure_name_search(); False when this SQLite build lacks FTS5/trigram
+FTS_ENABLED = False
+
+
+def ensure_name_search(conn: sqlite3.Connection) -> bool:
+    """
+    Create the external-content FTS5 tables + sync triggers (and build them
+    the first time). Returns False if FTS5 with the trigram tokenizer is unavailable.
+    """
+    existing = {r["name"] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    try:
+        for table, fts, rowid, col in NAME_SEARCH_TABLES:
+            conn.executescript(f"""
+                CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                  {col}, content='{table}', content_rowid='{rowid}', tokenize='trigram'
+                );
+                CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+                  INSERT INTO {fts}(rowid, {col}) VALUES (new.{rowid}, new.{col});
+                END;
+                CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+                  INSERT INTO {fts}({fts}, rowid, {col}) VALUES ('delete', old.{rowid}, old.{col});
+                END;
+                CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {col} ON {table} BEGIN
+                  INSERT INTO {fts}({fts}, rowid, {col}) VALUES ('delete', old.{rowid}, old.{col});
+                  INSERT INTO {fts}(rowid, {col}) VALUES (new.{rowid}, new.{col});
+                END;
+            """)
+            if fts not in existing:
+                conn.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+    except sqlite3.OperationalError as e:
+        print(f"[Search] FTS5 trigram unavailable, using LIKE: {e}")
+        return False
+    return True
+
+
+def name_filter(q: str) -> tuple[str, str]:
+    """
+    Filter kind + parameter for an infix (contains) name search:
+    ("match", phrase) for the FTS5 trigram index when available and q is long enough,
+    else ("like", pattern). The browse routes map the kind to their WHERE fragment.
+    """
+    if FTS_ENABLED and len(q) >= FTS_MIN_QUERY:
+        return "match", '"' + q.replace('"', '""') + '"'
+    return "like", f"%{q}%"
+
+
+def compile_browse_sql(select_sql: str, count_sql: str, fragments: dict,
+                       shapes, sort_map: dict) -> tuple[dict, dict]:
+    """
+    Pre-format every browse query the route can issue.
+    A shape is a tuple of `fragments` keys (ANDed in that order); returns
+    ({(sort_key, shape): page_sql}, {shape: count_sql}).
+    """
+    where = {
+        shape: ("WHERE " + " AND ".join(fragments[k] for k in shape)) if shape else ""
+        for shape in shapes
+    }
+    page = {
+        (sort_key, shape): select_sql.format(where_sql=where_sql, order_by=order_by)
+        for sort_key, order_by in sort_map.items()
+        for shape, where_sql in where.items()
+    }
+    count = {shape: count_sql.format(where_sql=where_sql) for shape, where_sql in where.items()}
+    return page, count
 
 
 def ensure_descriptors_table_schema():
     """
     Safety guard: ensures descriptors table exists with expected column names.
     Prevents schema mismatch issues (smiles/inchikey not inserting).
+    Also creates DB_INDEXES (running ANALYZE when any was missing) and
+    creates the v_phyto view, replacing it only if it differs from V_PHYTO_SQL.
+    Sets up FTS5 name search (see ensure_name_search).
     """
-    conn = get_db_connection()
+    global FTS_ENABLED
+    conn = get_db()
     conn.execute("""
         CREATE TABLE IF NOT EXISTS descriptors (
           phyto_id INTEGER PRIMARY KEY,
@@ -92,41 +321,150 @@ def ensure_descriptors_table_schema():
           FOREIGN KEY (phyto_id) REFERENCES phytochemicals(phyto_id)
         )
     """)
+
+    existing = {r["name"] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    missing = [sql for name, sql in DB_INDEXES.items() if name not in existing]
+    for sql in missing:
+        conn.execute(sql)
+    if missing:
+        conn.execute("ANALYZE")
+
+    # Replace v_phyto only when its definition changed, atomically: a bare DROP would
+    # auto-commit and other connections would briefly see no view at all.
+    current = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'view' AND name = 'v_phyto'").fetchone()
+    if current is None:
+        conn.execute(V_PHYTO_SQL)
+    elif current["sql"] != V_PHYTO_STORED_SQL:
+        conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DROP VIEW v_phyto")
+        conn.execute(V_PHYTO_SQL)
+        conn.commit()
+
+    FTS_ENABLED = ensure_name_search(conn)
+
     conn.commit()
-    conn.close()
 
 
 # =========================================================
 # PubChem: download helpers (ON-DEMAND)
 # =========================================================
 
-def download_file(url: str, dest: str, timeout: int = 25, retries: int = 3) -> bool:
+# PubChem sometimes returns HTML error page / invalid tiny responses
+MIN_DOWNLOAD_BYTES = 100
+DOWNLOAD_CHUNK = 64 * 1024
+
+
+def _http_get(url: str, timeout: int = 25, headers: dict | None = None,
+              preload_content: bool = True) -> urllib3.BaseHTTPResponse:
     """
-    Robust downloader with retry + backoff.
-    Skips if file already exists and is non-empty.
+    GET via the shared pool; raises urllib3 HTTPError on anything but 200/304.
+    (304 only comes back for conditional requests, see download_file.)
+    With preload_content=False the caller streams the body and must release_conn().
+    Every call takes a PUBCHEM_LIMITER token first.
+    """
+    PUBCHEM_LIMITER.acquire()
+    r = HTTP.request(
+        "GET", url, timeout=timeout, headers={**HTTP.headers, **(headers or {})},
+        preload_content=preload_content,
+    )
+    if r.status not in (200, 304):
+        if not preload_content:
+            r.drain_conn()
+            r.release_conn()
+        raise urllib3.exceptions.HTTPError(f"HTTP {r.status} for {url}")
+    return r
+
+
+def _stream_to_file(r: urllib3.BaseHTTPResponse, dest: str):
+    """
+    Copy the response body to dest in DOWNLOAD_CHUNK pieces via a temp file in
+    the same folder, then os.replace() it into place (readers never see partial files).
     """
+    tmp = tempfile.NamedTemporaryFile(dir=os.path.dirname(dest), prefix=".part-", delete=False)
     try:
-        if os.path.exists(dest) and os.path.getsize(dest) > 0:
-            return True
+        with tmp:
+            shutil.copyfileobj(r, tmp, DOWNLOAD_CHUNK)
+            size = tmp.tell()
+        if size < MIN_DOWNLOAD_BYTES:
+            raise ValueError("Downloaded content too small/invalid")
+        os.chmod(tmp.name, 0o644)  # mkstemp files are 0600; keep statics world-readable
+        os.replace(tmp.name, dest)
+    except BaseException:
+        try:
+            os.unlink(tmp.name)
+        except OSError:
+            pass
+        raise
+
+
+def _is_valid_download(path: str) -> bool:
+    try:
+        return os.path.getsize(path) >= MIN_DOWNLOAD_BYTES
     except OSError:
-        pass
+        return False
+
+
+def _validators_path(dest: str) -> str:
+    """VALIDATORS_DIR/<kind folder>/<file>.json, e.g. sdf2d/CID_2758.sdf.json."""
+    kind = os.path.basename(os.path.dirname(dest))
+    return os.path.join(VALIDATORS_DIR, kind, os.path.basename(dest) + ".json")
 
-    for attempt in range(1, retries + 1):
-        try:
-            req = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
-            with urllib.request.urlopen(req, timeout=timeout) as r:
-                content = r.read()
 
-            # PubChem sometimes returns HTML error page / invalid tiny responses
-            if not content or len(content) < 100:
-                raise ValueError("Downloaded content too small/invalid")
+def _load_validators(dest: str) -> dict:
+    """ETag / Last-Modified recorded for dest by the last 200 download."""
+    try:
+        with open(_validators_path(dest), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-            with open(dest, "wb") as f:
-                f.write(content)
 
+def _save_validators(dest: str, r: urllib3.BaseHTTPResponse):
+    meta = {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+    if not (meta["etag"] or meta["last_modified"]):
+        return
+    path = _validators_path(dest)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+    except OSError:
+        pass
+
+
+def download_file(url: str, dest: str, timeout: int = 25, retries: int = 3, revalidate: bool = False) -> bool:
+    """
+    Robust downloader with retry + backoff.
+    Skips if file already exists and is valid, unless revalidate=True and
+    validators were recorded for it: then a conditional GET (If-None-Match /
+    If-Modified-Since) is sent and a 304 keeps the local file without the body.
+    A valid file with no recorded validators is trusted as before.
+    """
+    headers = {}
+    if _is_valid_download(dest):
+        meta = _load_validators(dest) if revalidate else {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        if not headers:
             return True
 
-        except (urllib.error.HTTPError, urllib.error.URLError, TimeoutError, ValueError) as e:
+    for attempt in range(1, retries + 1):
+        try:
+            r = _http_get(url, timeout=timeout, headers=headers, preload_content=False)
+            try:
+                if r.status == 304:
+                    return _is_valid_download(dest)
+                _stream_to_file(r, dest)
+            finally:
+                r.release_conn()
+
+            _save_validators(dest, r)
+            return True
+
+        except (urllib3.exceptions.HTTPError, ValueError) as e:
             print(f"[Download] attempt {attempt}/{retries} failed: {e}")
             time.sleep(0.8 * attempt)
         except Exception as e:
@@ -136,97 +474,161 @@ def download_file(url: str, dest: str, timeout: int = 25, retries: int = 3) -> b
     return False
 
 
-def upsert_structure_paths(phyto_id: int, cid: int, got2d: bool, got3d: bool, gotpng: bool):
+# One statement per CID: flags only ever go 0 -> 1, NULL paths keep what is stored.
+STRUCTURES_UPSERT_SQL = """
+INSERT INTO structures (phyto_id, has_2d, has_3d, sdf_2d_path, sdf_3d_path, png_2d_path)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT(phyto_id) DO UPDATE SET
+  has_2d = MAX(COALESCE(structures.has_2d, 0), excluded.has_2d),
+  has_3d = MAX(COALESCE(structures.has_3d, 0), excluded.has_3d),
+  sdf_2d_path = COALESCE(excluded.sdf_2d_path, structures.sdf_2d_path),
+  sdf_3d_path = COALESCE(excluded.sdf_3d_path, structures.sdf_3d_path),
+  png_2d_path = COALESCE(excluded.png_2d_path, structures.png_2d_path)
+"""
+
+
+def structure_params(phyto_id: int, cid: int, got2d: bool, got3d: bool, gotpng: bool) -> tuple:
+    """STRUCTURES_UPSERT_SQL parameters; paths are relative to Flask /static."""
+    return (
+        phyto_id,
+        1 if got2d else 0,
+        1 if got3d else 0,
+        f"structures/sdf2d/CID_{cid}.sdf" if got2d else None,
+        f"structures/sdf3d/CID_{cid}.sdf" if got3d else None,
+        f"structures/png/CID_{cid}.png" if gotpng else None,
+    )
+
+
+def upsert_structure_paths(conn: sqlite3.Connection, phyto_id: int, cid: int,
+                           got2d: bool, got3d: bool, gotpng: bool) -> dict:
     """
     Ensure structures row exists and update paths for downloaded files.
     Paths are relative to Flask /static.
+    Does not commit: the caller owns the transaction (single row or batch).
+    Returns the structures columns that were written.
     """
-    conn = get_db_connection()
-
-    conn.execute(
-        """
-        INSERT INTO structures (phyto_id, has_2d, has_3d, sdf_2d_path, sdf_3d_path, png_2d_path)
-        VALUES (?, 0, 0, NULL, NULL, NULL)
-        ON CONFLICT(phyto_id) DO NOTHING
-        """,
-        (phyto_id,),
-    )
+    params = structure_params(phyto_id, cid, got2d, got3d, gotpng)
+    conn.execute(STRUCTURES_UPSERT_SQL, params)
 
+    written = {}
     if got2d:
-        conn.execute(
-            "UPDATE structures SET has_2d = 1, sdf_2d_path = ? WHERE phyto_id = ?",
-            (f"structures/sdf2d/CID_{cid}.sdf", phyto_id),
-        )
+        written.update(has_2d=1, sdf_2d_path=params[3])
     if got3d:
-        conn.execute(
-            "UPDATE structures SET has_3d = 1, sdf_3d_path = ? WHERE phyto_id = ?",
-            (f"structures/sdf3d/CID_{cid}.sdf", phyto_id),
-        )
+        written.update(has_3d=1, sdf_3d_path=params[4])
     if gotpng:
-        conn.execute(
-            "UPDATE structures SET png_2d_path = ? WHERE phyto_id = ?",
-            (f"structures/png/CID_{cid}.png", phyto_id),
-        )
+        written["png_2d_path"] = params[5]
+    return written
+
+
+def structure_downloads(cid: int) -> list[tuple[str, str]]:
+    """(url, dest) pairs for 2D SDF, 3D SDF and PNG, in that order."""
+    return [
+        (f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/CID/{cid}/SDF?record_type=2d",
+         os.path.join(SDF2D_DIR, f"CID_{cid}.sdf")),
+        (f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/CID/{cid}/SDF?record_type=3d",
+         os.path.join(SDF3D_DIR, f"CID_{cid}.sdf")),
+        (f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/CID/{cid}/PNG",
+         os.path.join(PNG_DIR, f"CID_{cid}.png")),
+    ]
 
-    conn.commit()
-    conn.close()
+
+def submit_structure_downloads(cid: int, revalidate: bool = False,
+                               pool: ThreadPoolExecutor = ONDEMAND_POOL) -> list:
+    """Queue the three downloads for this CID on pool (admin batches pass DOWNLOAD_POOL); returns futures."""
+    ensure_structure_dirs()
+    return [
+        pool.submit(download_file, url, dest, revalidate=revalidate)
+        for url, dest in structure_downloads(cid)
+    ]
 
 
-def fetch_structures_on_demand(phyto_id: int, cid: int) -> bool:
+def download_structure_files(cid: int) -> tuple[bool, bool, bool]:
     """
-    Download missing structure files for this CID and update DB.
-    Returns True if any file succeeded.
+    Download 2D SDF, 3D SDF and PNG for this CID concurrently.
+    Returns (got2d, got3d, gotpng). No DB access.
     """
-    if not cid:
-        return False
+    got2d, got3d, gotpng = (f.result() for f in submit_structure_downloads(cid))
+    return got2d, got3d, gotpng
 
-    ensure_structure_dirs()
 
-    sdf2d_url = f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/CID/{cid}/SDF?record_type=2d"
-    sdf3d_url = f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/CID/{cid}/SDF?record_type=3d"
-    png_url = f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/CID/{cid}/PNG"
-
-    sdf2d_dest = os.path.join(SDF2D_DIR, f"CID_{cid}.sdf")
-    sdf3d_dest = os.path.join(SDF3D_DIR, f"CID_{cid}.sdf")
-    png_dest = os.path.join(PNG_DIR, f"CID_{cid}.png")
+def fetch_structures_on_demand(phyto_id: int, cid: int) -> dict:
+    """
+    Download missing structure files for this CID and update DB.
+    Returns the structures columns written ({} if no file succeeded).
+    """
+    if not cid:
+        return {}
 
-    got2d = download_file(sdf2d_url, sdf2d_dest)
-    got3d = download_file(sdf3d_url, sdf3d_dest)
-    gotpng = download_file(png_url, png_dest)
+    got2d, got3d, gotpng = download_structure_files(cid)
 
     if got2d or got3d or gotpng:
-        upsert_structure_paths(
+        conn = get_db()
+        written = upsert_structure_paths(
+            conn,
             phyto_id=phyto_id,
             cid=cid,
             got2d=got2d,
             got3d=got3d,
             gotpng=gotpng,
         )
-        time.sleep(0.2)
-        return True
+        conn.commit()
+        return written
 
-    return False
+    return {}
 
 # =========================================================
 # PubChem: descriptors + formats fetch (ON-DEMAND)
 #   ✅ includes TXT fallback logic for missing SMILES
 # =========================================================
 
-def _pubchem_get_properties(cid: int, props: list[str]) -> dict:
+DESCRIPTOR_PROPS = [
+    "MolecularFormula",
+    "MolecularWeight",
+    "XLogP",
+    "TPSA",
+    "HBondDonorCount",
+    "HBondAcceptorCount",
+    "RotatableBondCount",
+    "HeavyAtomCount",
+    "Complexity",
+    "Charge",
+
+    # formats
+    "CanonicalSMILES",
+    "IsomericSMILES",
+    "InChI",
+    "InChIKey",
+    "IUPACName",
+]
+
+# PubChem accepts a comma-separated CID list in one property request
+DESCRIPTORS_BULK_CHUNK = 100
+
+
+def _pubchem_property_table(cids: list[int], props: list[str]) -> list[dict]:
     """
-    Request PubChem property JSON and return Properties[0] dict.
+    Request PubChem property JSON for one or more CIDs and return the Properties list
+    (one dict per CID found, each carrying its "CID").
     Raises exception if not available.
     """
     url = (
-        f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/CID/{cid}/property/"
+        "https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/CID/"
+        + ",".join(str(c) for c in cids)
+        + "/property/"
         + ",".join(props)
         + "/JSON"
     )
-    req = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
-    with urllib.request.urlopen(req, timeout=25) as r:
-        data = json.loads(r.read().decode("utf-8"))
+    data = json.loads(_http_get(url).data.decode("utf-8"))
+
+    return data["PropertyTable"]["Properties"]
+
 
-    return data["PropertyTable"]["Properties"][0]
+def _pubchem_get_properties(cid: int, props: list[str]) -> dict:
+    """
+    Request PubChem property JSON and return Properties[0] dict.
+    Raises exception if not available.
+    """
+    return _pubchem_property_table([cid], props)[0]
 
 
 def _pubchem_get_txt(cid: int, prop: str):
@@ -236,72 +638,113 @@ def _pubchem_get_txt(cid: int, prop: str):
     """
     url = f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/CID/{cid}/property/{prop}/TXT"
     try:
-        req = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
-        with urllib.request.urlopen(req, timeout=25) as r:
-            txt = r.read().decode("utf-8").strip()
+        txt = _http_get(url).data.decode("utf-8").strip()
         return txt if txt and txt.lower() != "null" else None
     except Exception:
         return None
 
 
-def fetch_descriptors_from_pubchem(phyto_id: int, cid: int) -> bool:
+DESCRIPTORS_UPSERT_SQL = """
+INSERT INTO descriptors (
+  phyto_id,
+  molecular_formula, molecular_weight, xlogp, tpsa,
+  hbd, hba, rotatable_bonds, heavy_atom_count,
+  complexity, charge,
+  smiles, isomeric_smiles, inchi, inchikey, iupac_name
+)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(phyto_id) DO UPDATE SET
+  molecular_formula=excluded.molecular_formula,
+  molecular_weight=excluded.molecular_weight,
+  xlogp=excluded.xlogp,
+  tpsa=excluded.tpsa,
+  hbd=excluded.hbd,
+  hba=excluded.hba,
+  rotatable_bonds=excluded.rotatable_bonds,
+  heavy_atom_count=excluded.heavy_atom_count,
+  complexity=excluded.complexity,
+  charge=excluded.charge,
+  smiles=excluded.smiles,
+  isomeric_smiles=excluded.isomeric_smiles,
+  inchi=excluded.inchi,
+  inchikey=excluded.inchikey,
+  iupac_name=excluded.iupac_name
+"""
+
+
+def _real(x):
     """
-    Fetch descriptors + formats from PubChem (CID) and store into descriptors table.
-    Uses TXT fallbacks for CanonicalSMILES / IsomericSMILES if missing from JSON.
+    PubChem sends some numeric properties as strings (e.g. MolecularWeight).
+    Normalized to numbers at write time, rounded to 2 decimals (PubChem's own precision).
     """
-    if not cid:
-        return False
+    return None if x is None else round(float(x), 2)
+
+
+def _int(x):
+    return None if x is None else int(x)
+
+
+def _descriptor_row(props_obj: dict) -> dict:
+    """Map one PubChem Properties entry onto descriptors columns."""
+    return {
+        "molecular_formula": props_obj.get("MolecularFormula"),
+        "molecular_weight": _real(props_obj.get("MolecularWeight")),
+        "xlogp": _real(props_obj.get("XLogP")),
+        "tpsa": _real(props_obj.get("TPSA")),
+        "hbd": _int(props_obj.get("HBondDonorCount")),
+        "hba": _int(props_obj.get("HBondAcceptorCount")),
+        "rotatable_bonds": _int(props_obj.get("RotatableBondCount")),
+        "heavy_atom_count": _int(props_obj.get("HeavyAtomCount")),
+        "complexity": _real(props_obj.get("Complexity")),
+        "charge": _int(props_obj.get("Charge")),
+
+        "smiles": props_obj.get("CanonicalSMILES"),
+        "isomeric_smiles": props_obj.get("IsomericSMILES"),
+        "inchi": props_obj.get("InChI"),
+        "inchikey": props_obj.get("InChIKey"),
+        "iupac_name": props_obj.get("IUPACName"),
+    }
 
-    ensure_descriptors_table_schema()
-
-    props = [
-        "MolecularFormula",
-        "MolecularWeight",
-        "XLogP",
-        "TPSA",
-        "HBondDonorCount",
-        "HBondAcceptorCount",
-        "RotatableBondCount",
-        "HeavyAtomCount",
-        "Complexity",
-        "Charge",
-
-        # formats
-        "CanonicalSMILES",
-        "IsomericSMILES",
-        "InChI",
-        "InChIKey",
-        "IUPACName",
+
+def _fill_smiles_fallbacks(rows: list[tuple[int, dict]], pool: ThreadPoolExecutor = ONDEMAND_POOL):
+    """
+    ✅ TXT fallback for SMILES (handles your exact problem cases).
+    rows is [(cid, row), ...]; all missing values are fetched concurrently on pool,
+    rows updated in place.
+    """
+    fallbacks = [
+        (row, key, pool.submit(_pubchem_get_txt, cid, prop))
+        for cid, row in rows
+        for key, prop in (("smiles", "CanonicalSMILES"), ("isomeric_smiles", "IsomericSMILES"))
+        if row[key] is None
     ]
+    for row, key, fut in fallbacks:
+        row[key] = fut.result()
+
+
+def _descriptor_params(phyto_id: int, row: dict) -> tuple:
+    """DESCRIPTORS_UPSERT_SQL parameters for one row."""
+    return (
+        phyto_id,
+        row["molecular_formula"], row["molecular_weight"], row["xlogp"], row["tpsa"],
+        row["hbd"], row["hba"], row["rotatable_bonds"], row["heavy_atom_count"],
+        row["complexity"], row["charge"],
+        row["smiles"], row["isomeric_smiles"], row["inchi"], row["inchikey"], row["iupac_name"],
+    )
 
-    try:
-        props_obj = _pubchem_get_properties(cid, props)
-
-        row = {
-            "molecular_formula": props_obj.get("MolecularFormula"),
-            "molecular_weight": props_obj.get("MolecularWeight"),
-            "xlogp": props_obj.get("XLogP"),
-            "tpsa": props_obj.get("TPSA"),
-            "hbd": props_obj.get("HBondDonorCount"),
-            "hba": props_obj.get("HBondAcceptorCount"),
-            "rotatable_bonds": props_obj.get("RotatableBondCount"),
-            "heavy_atom_count": props_obj.get("HeavyAtomCount"),
-            "complexity": props_obj.get("Complexity"),
-            "charge": props_obj.get("Charge"),
-
-            "smiles": props_obj.get("CanonicalSMILES"),
-            "isomeric_smiles": props_obj.get("IsomericSMILES"),
-            "inchi": props_obj.get("InChI"),
-            "inchikey": props_obj.get("InChIKey"),
-            "iupac_name": props_obj.get("IUPACName"),
-        }
 
-        # ✅ TXT fallback for SMILES (handles your exact problem cases)
-        if row["smiles"] is None:
-            row["smiles"] = _pubchem_get_txt(cid, "CanonicalSMILES")
+def fetch_descriptors_from_pubchem(phyto_id: int, cid: int) -> dict | None:
+    """
+    Fetch descriptors + formats from PubChem (CID) and store into descriptors table.
+    Uses TXT fallbacks for CanonicalSMILES / IsomericSMILES if missing from JSON.
+    Returns the descriptors row that was written, or None on failure.
+    """
+    if not cid:
+        return None
 
-        if row["isomeric_smiles"] is None:
-            row["isomeric_smiles"] = _pubchem_get_txt(cid, "IsomericSMILES")
+    try:
+        row = _descriptor_row(_pubchem_get_properties(cid, DESCRIPTOR_PROPS))
+        _fill_smiles_fallbacks([(cid, row)])
 
         print("\n========== DESCRIPTORS DEBUG ==========")
         print("phyto_id:", phyto_id)
@@ -313,51 +756,43 @@ def fetch_descriptors_from_pubchem(phyto_id: int, cid: int) -> bool:
         print("inchi:", "present" if row["inchi"] else None)
         print("======================================\n")
 
-        conn = get_db_connection()
-        conn.execute(
-            """
-            INSERT INTO descriptors (
-              phyto_id,
-              molecular_formula, molecular_weight, xlogp, tpsa,
-              hbd, hba, rotatable_bonds, heavy_atom_count,
-              complexity, charge,
-              smiles, isomeric_smiles, inchi, inchikey, iupac_name
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(phyto_id) DO UPDATE SET
-              molecular_formula=excluded.molecular_formula,
-              molecular_weight=excluded.molecular_weight,
-              xlogp=excluded.xlogp,
-              tpsa=excluded.tpsa,
-              hbd=excluded.hbd,
-              hba=excluded.hba,
-              rotatable_bonds=excluded.rotatable_bonds,
-              heavy_atom_count=excluded.heavy_atom_count,
-              complexity=excluded.complexity,
-              charge=excluded.charge,
-              smiles=excluded.smiles,
-              isomeric_smiles=excluded.isomeric_smiles,
-              inchi=excluded.inchi,
-              inchikey=excluded.inchikey,
-              iupac_name=excluded.iupac_name
-            """,
-            (
-                phyto_id,
-                row["molecular_formula"], row["molecular_weight"], row["xlogp"], row["tpsa"],
-                row["hbd"], row["hba"], row["rotatable_bonds"], row["heavy_atom_count"],
-                row["complexity"], row["charge"],
-                row["smiles"], row["isomeric_smiles"], row["inchi"], row["inchikey"], row["iupac_name"],
-            ),
-        )
+        conn = get_db()
+        conn.execute(DESCRIPTORS_UPSERT_SQL, _descriptor_params(phyto_id, row))
         conn.commit()
-        conn.close()
-
-        time.sleep(0.2)
-        return True
+        return row
 
     except Exception as e:
         print(f"[Descriptors] Failed (phyto_id={phyto_id}, CID={cid}): {e}")
-        return False
+        return None
+
+
+def fetch_descriptors_bulk(pairs: list[tuple[int, int]]) -> int:
+    """
+    Bulk variant for backfills: pairs is [(phyto_id, cid), ...].
+    One PubChem request per DESCRIPTORS_BULK_CHUNK CIDs (chunks in flight concurrently),
+    then a single executemany UPSERT in one transaction. Returns rows written.
+    """
+    by_cid = {int(cid): int(phyto_id) for phyto_id, cid in pairs if cid}
+    cids = list(by_cid)
+    chunks = [cids[i:i + DESCRIPTORS_BULK_CHUNK] for i in range(0, len(cids), DESCRIPTORS_BULK_CHUNK)]
+    futures = [DOWNLOAD_POOL.submit(_pubchem_property_table, chunk, DESCRIPTOR_PROPS) for chunk in chunks]
+
+    rows = []
+    for chunk, fut in zip(chunks, futures):
+        try:
+            rows.extend((int(p["CID"]), _descriptor_row(p)) for p in fut.result() if int(p["CID"]) in by_cid)
+        except Exception as e:
+            print(f"[Descriptors] Bulk chunk failed ({len(chunk)} CIDs from {chunk[0]}): {e}")
+
+    _fill_smiles_fallbacks(rows, DOWNLOAD_POOL)
+
+    conn = get_db()
+    conn.execute("BEGIN")
+    conn.executemany(DESCRIPTORS_UPSERT_SQL, [_descriptor_params(by_cid[cid], row) for cid, row in rows])
+    conn.commit()
+    return len(rows)
+
+
 # =========================================================
 # Drug-likeness rules
 # =========================================================
@@ -366,56 +801,105 @@ def calc_druglikeness_rules(d):
     """
     d is sqlite3.Row/dict-like object containing:
     molecular_weight, xlogp, tpsa, hbd, hba, rotatable_bonds
-    Returns dict with rule results.
+    Returns dict with rule results (cached; treat as read-only).
+    Values are already numeric: REAL/INTEGER column affinity on read, and
+    _real/_int when fetch_descriptors_from_pubchem builds a fresh row.
     """
+    return _druglikeness_rules(
+        d["molecular_weight"],
+        d["xlogp"],
+        d["tpsa"],
+        d["hbd"],
+        d["hba"],
+        d["rotatable_bonds"],
+    )
 
-    def _num(x):
-        return None if x is None else float(x)
 
-    mw = _num(d["molecular_weight"])
-    xlogp = _num(d["xlogp"])
-    tpsa = _num(d["tpsa"])
-    hbd = d["hbd"]
-    hba = d["hba"]
-    rot = d["rotatable_bonds"]
+# One bit per distinct threshold check; a missing value (None -> NaN) never fails.
+FAIL_MW_500 = 1 << 0
+FAIL_XLOGP_5 = 1 << 1
+FAIL_HBD_5 = 1 << 2
+FAIL_HBA_10 = 1 << 3
+FAIL_ROT_10 = 1 << 4
+FAIL_TPSA_140 = 1 << 5
+FAIL_MW_GHOSE = 1 << 6      # MW outside 160–480
+FAIL_XLOGP_GHOSE = 1 << 7   # XLogP outside −0.4–5.6
+FAIL_TPSA_131 = 1 << 8
+FAIL_XLOGP_588 = 1 << 9
+FAIL_MW_MUEGGE = 1 << 10    # MW outside 200–600
+FAIL_TPSA_150 = 1 << 11
+FAIL_ROT_15 = 1 << 12
+
+# (rule, note, ((bit, message), ...)); a rule's mask is the OR of its bits
+DRUG_RULES = (
+    ("Lipinski", "Rule of 5", (
+        (FAIL_MW_500, "MW > 500"),
+        (FAIL_XLOGP_5, "XlogP > 5"),
+        (FAIL_HBD_5, "HBD > 5"),
+        (FAIL_HBA_10, "HBA > 10"),
+    )),
+    ("Veber", "Oral bioavailability", (
+        (FAIL_ROT_10, "RotB > 10"),
+        (FAIL_TPSA_140, "TPSA > 140"),
+    )),
+    ("Ghose", "Drug-likeness (Ghose)", (
+        (FAIL_MW_GHOSE, "MW not in 160–480"),
+        (FAIL_XLOGP_GHOSE, "XLogP not in −0.4–5.6"),
+    )),
+    ("Egan", "Absorption/permeation", (
+        (FAIL_TPSA_131, "TPSA > 131.6"),
+        (FAIL_XLOGP_588, "XlogP > 5.88"),
+    )),
+    ("Muegge", "Drug-likeness (Muegge)", (
+        (FAIL_MW_MUEGGE, "MW not in 200–600"),
+        (FAIL_XLOGP_5, "XLogP > 5"),
+        (FAIL_TPSA_150, "TPSA > 150"),
+        (FAIL_HBD_5, "HBD > 5"),
+        (FAIL_HBA_10, "HBA > 10"),
+        (FAIL_ROT_15, "RotB > 15"),
+    )),
+)
+DRUG_RULE_MASKS = tuple(
+    (name, note, checks, sum(bit for bit, _ in checks)) for name, note, checks in DRUG_RULES
+)
+
+_NAN = float("nan")
+
+
+def druglikeness_fail_mask(mw, xlogp, tpsa, hbd, hba, rot) -> int:
+    """All threshold checks at once as a FAIL_* bitmask (comparisons with NaN are False)."""
+    mw = _NAN if mw is None else mw
+    xlogp = _NAN if xlogp is None else xlogp
+    tpsa = _NAN if tpsa is None else tpsa
+    hbd = _NAN if hbd is None else hbd
+    hba = _NAN if hba is None else hba
+    rot = _NAN if rot is None else rot
+    return (
+        (mw > 500) * FAIL_MW_500
+        | (xlogp > 5) * FAIL_XLOGP_5
+        | (hbd > 5) * FAIL_HBD_5
+        | (hba > 10) * FAIL_HBA_10
+        | (rot > 10) * FAIL_ROT_10
+        | (tpsa > 140) * FAIL_TPSA_140
+        | ((mw < 160) | (mw > 480)) * FAIL_MW_GHOSE
+        | ((xlogp < -0.4) | (xlogp > 5.6)) * FAIL_XLOGP_GHOSE
+        | (tpsa > 131.6) * FAIL_TPSA_131
+        | (xlogp > 5.88) * FAIL_XLOGP_588
+        | ((mw < 200) | (mw > 600)) * FAIL_MW_MUEGGE
+        | (tpsa > 150) * FAIL_TPSA_150
+        | (rot > 15) * FAIL_ROT_15
+    )
 
-    results = {}
 
-    # Lipinski
-    fails = []
-    if mw is not None and mw > 500: fails.append("MW > 500")
-    if xlogp is not None and xlogp > 5: fails.append("XlogP > 5")
-    if hbd is not None and hbd > 5: fails.append("HBD > 5")
-    if hba is not None and hba > 10: fails.append("HBA > 10")
-    results["Lipinski"] = {"pass": len(fails) == 0, "fail_count": len(fails), "fails": fails, "note": "Rule of 5"}
-
-    # Veber
-    fails = []
-    if rot is not None and rot > 10: fails.append("RotB > 10")
-    if tpsa is not None and tpsa > 140: fails.append("TPSA > 140")
-    results["Veber"] = {"pass": len(fails) == 0, "fail_count": len(fails), "fails": fails, "note": "Oral bioavailability"}
-
-    # Ghose (partial)
-    fails = []
-    if mw is not None and (mw < 160 or mw > 480): fails.append("MW not in 160–480")
-    if xlogp is not None and (xlogp < -0.4 or xlogp > 5.6): fails.append("XLogP not in −0.4–5.6")
-    results["Ghose"] = {"pass": len(fails) == 0, "fail_count": len(fails), "fails": fails, "note": "Drug-likeness (Ghose)"}
-
-    # Egan
-    fails = []
-    if tpsa is not None and tpsa > 131.6: fails.append("TPSA > 131.6")
-    if xlogp is not None and xlogp > 5.88: fails.append("XlogP > 5.88")
-    results["Egan"] = {"pass": len(fails) == 0, "fail_count": len(fails), "fails": fails, "note": "Absorption/permeation"}
-
-    # Muegge
-    fails = []
-    if mw is not None and (mw < 200 or mw > 600): fails.append("MW not in 200–600")
-    if xlogp is not None and xlogp > 5: fails.append("XLogP > 5")
-    if tpsa is not None and tpsa > 150: fails.append("TPSA > 150")
-    if hbd is not None and hbd > 5: fails.append("HBD > 5")
-    if hba is not None and hba > 10: fails.append("HBA > 10")
-    if rot is not None and rot > 15: fails.append("RotB > 15")
-    results["Muegge"] = {"pass": len(fails) == 0, "fail_count": len(fails), "fails": fails, "note": "Drug-likeness (Muegge)"}
+@lru_cache(maxsize=4096)
+def _druglikeness_rules(mw, xlogp, tpsa, hbd, hba, rot):
+    mask = druglikeness_fail_mask(mw, xlogp, tpsa, hbd, hba, rot)
+
+    results = {}
+    for name, note, checks, rule_mask in DRUG_RULE_MASKS:
+        failed = mask & rule_mask
+        fails = [msg for bit, msg in checks if failed & bit] if failed else []
+        results[name] = {"pass": not failed, "fail_count": failed.bit_count(), "fails": fails, "note": note}
 
     return results
 
@@ -424,13 +908,22 @@ def calc_druglikeness_rules(d):
 # Routes
 # =========================================================
 
+# Home totals only change when load_data.py / fix_duplicates.py run.
+HOME_COUNTS_TTL = 60
+_home_counts = {"expires": 0.0, "counts": None}
+
+
 @app.route("/")
 def home():
-    counts = {
-        "spices": query_db("SELECT COUNT(*) AS c FROM spices", one=True)["c"],
-        "phytochemicals": query_db("SELECT COUNT(*) AS c FROM phytochemicals", one=True)["c"],
-        "links": query_db("SELECT COUNT(*) AS c FROM spice_phytochemicals", one=True)["c"],
-    }
+    now = time.monotonic()
+    if _home_counts["counts"] is None or now >= _home_counts["expires"]:
+        _home_counts["counts"] = {
+            "spices": query_db("SELECT COUNT(*) AS c FROM spices", one=True)["c"],
+            "phytochemicals": query_db("SELECT COUNT(*) AS c FROM phytochemicals", one=True)["c"],
+            "links": query_db("SELECT COUNT(*) AS c FROM spice_phytochemicals", one=True)["c"],
+        }
+        _home_counts["expires"] = now + HOME_COUNTS_TTL
+    counts = _home_counts["counts"]
     return render_template("home_spices.html", counts=counts)
 
 
@@ -438,73 +931,61 @@ def home():
 # Browse Spices
 # -------------------------
 
+SPICE_BROWSE_COUNT_SQL = """
+SELECT COUNT(*) AS c
+FROM spices
+{where_sql}
+"""
+
+SPICE_BROWSE_SQL = """
+SELECT spice_id, spice_name, botanical_name,
+       COUNT(*) OVER () AS total_count
+FROM spices
+{where_sql}
+ORDER BY {order_by}
+LIMIT ? OFFSET ?
+"""
+
+SORT_MAP_SPICE = {
+    "name_asc": "spice_name ASC",
+    "name_desc": "spice_name DESC",
+}
+
+SPICE_WHERE = {
+    "starts": "spice_name LIKE ?",
+    "match": "spice_id IN (SELECT rowid FROM spice_fts WHERE spice_fts MATCH ?)",
+    "like": "spice_name LIKE ?",
+}
+
+SPICE_BROWSE_QUERIES, SPICE_COUNT_QUERIES = compile_browse_sql(
+    SPICE_BROWSE_SQL, SPICE_BROWSE_COUNT_SQL, SPICE_WHERE,
+    [(), ("starts",), ("match",), ("like",)], SORT_MAP_SPICE,
+)
+
+
 @app.route("/browse/spices")
 def browse_spices():
     q = (request.args.get("q") or "").strip()
     starts = (request.args.get("starts") or "").strip().upper()
 
     sort = request.args.get("sort", "name_asc")
-    sort_map = {
-        "name_asc": "spice_name ASC",
-        "name_desc": "spice_name DESC",
-    }
-    order_by = sort_map.get(sort, "spice_name ASC")
-
-    page = int(request.args.get("page", 1))
-    per_page = int(request.args.get("per_page", 25))
-    per_page = max(5, min(per_page, 200))
-    offset = (page - 1) * per_page
+    sort_key = sort if sort in SORT_MAP_SPICE else "name_asc"
 
+    page, per_page, offset = page_args()
     base_qs = build_base_qs()
 
+    shape = ()
+    params = ()
     if starts and len(starts) == 1 and starts.isalpha():
-        total = query_db(
-            "SELECT COUNT(*) AS c FROM spices WHERE spice_name LIKE ?",
-            (f"{starts}%",),
-            one=True,
-        )["c"]
-
-        rows = query_db(
-            f"""
-            SELECT spice_id, spice_name, botanical_name
-            FROM spices
-            WHERE spice_name LIKE ?
-            ORDER BY {order_by}
-            LIMIT ? OFFSET ?
-            """,
-            (f"{starts}%", per_page, offset),
-        )
-
+        shape = ("starts",)
+        params = (f"{starts}%",)
     elif q:
-        total = query_db(
-            "SELECT COUNT(*) AS c FROM spices WHERE spice_name LIKE ?",
-            (f"%{q}%",),
-            one=True,
-        )["c"]
+        kind, param = name_filter(q)
+        shape = (kind,)
+        params = (param,)
 
-        rows = query_db(
-            f"""
-            SELECT spice_id, spice_name, botanical_name
-            FROM spices
-            WHERE spice_name LIKE ?
-            ORDER BY {order_by}
-            LIMIT ? OFFSET ?
-            """,
-            (f"%{q}%", per_page, offset),
-        )
-
-    else:
-        total = query_db("SELECT COUNT(*) AS c FROM spices", one=True)["c"]
-
-        rows = query_db(
-            f"""
-            SELECT spice_id, spice_name, botanical_name
-            FROM spices
-            ORDER BY {order_by}
-            LIMIT ? OFFSET ?
-            """,
-            (per_page, offset),
-        )
+    rows = query_db(SPICE_BROWSE_QUERIES[sort_key, shape], params + (per_page, offset))
+    total = page_total(rows, offset, SPICE_COUNT_QUERIES[shape], params)
 
     return render_template(
         "browse_spices.html",
@@ -547,6 +1028,64 @@ def api_search_spices():
 # Browse Phytochemicals
 # -------------------------
 
+# Fixed query shapes: the same filters/sort always format to the same SQL text,
+# so repeat requests hit the connection's statement cache. The page SELECT returns
+# the total via COUNT(*) OVER (); the COUNT query is only for pages past the end.
+PHYTO_BROWSE_COUNT_SQL = """
+SELECT COUNT(*) AS c
+FROM v_phyto p
+{where_sql}
+"""
+
+PHYTO_BROWSE_SQL = """
+SELECT
+    p.phyto_id,
+    p.phyto_name,
+    p.cid,
+    p.has_2d,
+    p.has_3d,
+    COALESCE(sc.spice_count, 0) AS spice_count,
+    COUNT(*) OVER () AS total_count
+FROM v_phyto p
+LEFT JOIN (
+    SELECT phyto_id, COUNT(*) AS spice_count
+    FROM spice_phytochemicals
+    GROUP BY phyto_id
+) sc ON sc.phyto_id = p.phyto_id
+{where_sql}
+ORDER BY {order_by}
+LIMIT ? OFFSET ?
+"""
+
+SORT_MAP_PHYTO = {
+    "name_asc": "p.phyto_name ASC",
+    "name_desc": "p.phyto_name DESC",
+    "cid_asc": "p.cid ASC",
+    "cid_desc": "p.cid DESC",
+    "spice_count_desc": "spice_count DESC",
+}
+
+PHYTO_WHERE = {
+    "cid": "p.cid = ?",
+    "match": "p.phyto_id IN (SELECT rowid FROM phyto_fts WHERE phyto_fts MATCH ?)",
+    "like": "p.phyto_name LIKE ?",
+    "only_cid": "p.cid IS NOT NULL",
+    # strict filters
+    "only_3d": "p.has_3d = 1",
+    "only_2d": "p.has_2d = 1 AND p.has_3d = 0",
+}
+
+# shape = (search kind?, only_cid?, only_3d|only_2d?) with unused slots dropped
+PHYTO_SHAPES = [
+    tuple(k for k in combo if k)
+    for combo in product((None, "cid", "match", "like"), (None, "only_cid"), (None, "only_3d", "only_2d"))
+]
+
+PHYTO_BROWSE_QUERIES, PHYTO_COUNT_QUERIES = compile_browse_sql(
+    PHYTO_BROWSE_SQL, PHYTO_BROWSE_COUNT_SQL, PHYTO_WHERE, PHYTO_SHAPES, SORT_MAP_PHYTO,
+)
+
+
 @app.route("/browse/phytochemicals")
 def browse_phytochemicals():
     q = (request.args.get("q") or "").strip()
@@ -561,72 +1100,35 @@ def browse_phytochemicals():
         only_3d = False
 
     sort = request.args.get("sort", "name_asc")
-    sort_map = {
-        "name_asc": "p.phyto_name ASC",
-        "name_desc": "p.phyto_name DESC",
-        "cid_asc": "p.cid ASC",
-        "cid_desc": "p.cid DESC",
-        "spice_count_desc": "spice_count DESC",
-    }
-    order_by = sort_map.get(sort, "p.phyto_name ASC")
+    sort_key = sort if sort in SORT_MAP_PHYTO else "name_asc"
 
-    page = int(request.args.get("page", 1))
-    per_page = int(request.args.get("per_page", 25))
-    per_page = max(5, min(per_page, 200))
-    offset = (page - 1) * per_page
+    page, per_page, offset = page_args()
     base_qs = build_base_qs()
 
-    where = []
+    shape = []
     params = []
 
     if q:
         if q.isdigit():
-            where.append("p.cid = ?")
+            shape.append("cid")
             params.append(int(q))
         else:
-            where.append("p.phyto_name LIKE ?")
-            params.append(f"%{q}%")
+            kind, param = name_filter(q)
+            shape.append(kind)
+            params.append(param)
 
     if only_cid:
-        where.append("p.cid IS NOT NULL")
+        shape.append("only_cid")
 
-    # strict filters
     if only_3d:
-        where.append("COALESCE(s.has_3d, 0) = 1")
+        shape.append("only_3d")
 
     if only_2d:
-        where.append("COALESCE(s.has_2d, 0) = 1 AND COALESCE(s.has_3d, 0) = 0")
+        shape.append("only_2d")
 
-    where_sql = ("WHERE " + " AND ".join(where)) if where else ""
-
-    total = query_db(
-        f"""
-        SELECT COUNT(*) AS c
-        FROM phytochemicals p
-        LEFT JOIN structures s ON s.phyto_id = p.phyto_id
-        {where_sql}
-        """,
-        tuple(params),
-        one=True,
-    )["c"]
-
-    rows = query_db(
-        f"""
-        SELECT
-            p.phyto_id,
-            p.phyto_name,
-            p.cid,
-            COALESCE(s.has_2d, 0) AS has_2d,
-            COALESCE(s.has_3d, 0) AS has_3d,
-            (SELECT COUNT(*) FROM spice_phytochemicals sp WHERE sp.phyto_id = p.phyto_id) AS spice_count
-        FROM phytochemicals p
-        LEFT JOIN structures s ON s.phyto_id = p.phyto_id
-        {where_sql}
-        ORDER BY {order_by}
-        LIMIT ? OFFSET ?
-        """,
-        tuple(params + [per_page, offset]),
-    )
+    shape = tuple(shape)
+    rows = query_db(PHYTO_BROWSE_QUERIES[sort_key, shape], tuple(params + [per_page, offset]))
+    total = page_total(rows, offset, PHYTO_COUNT_QUERIES[shape], tuple(params))
 
     return render_template(
         "browse_phytochemicals.html",
@@ -653,11 +1155,8 @@ def api_search_phytochemicals():
     if q.isdigit():
         rows = query_db(
             """
-            SELECT p.phyto_id, p.phyto_name, p.cid,
-                   COALESCE(s.has_2d,0) AS has_2d,
-                   COALESCE(s.has_3d,0) AS has_3d
-            FROM phytochemicals p
-            LEFT JOIN structures s ON s.phyto_id = p.phyto_id
+            SELECT p.phyto_id, p.phyto_name, p.cid, p.has_2d, p.has_3d
+            FROM v_phyto p
             WHERE p.cid = ?
             ORDER BY p.phyto_name ASC
             LIMIT ?
@@ -667,11 +1166,8 @@ def api_search_phytochemicals():
     else:
         rows = query_db(
             """
-            SELECT p.phyto_id, p.phyto_name, p.cid,
-                   COALESCE(s.has_2d,0) AS has_2d,
-                   COALESCE(s.has_3d,0) AS has_3d
-            FROM phytochemicals p
-            LEFT JOIN structures s ON s.phyto_id = p.phyto_id
+            SELECT p.phyto_id, p.phyto_name, p.cid, p.has_2d, p.has_3d
+            FROM v_phyto p
             WHERE p.phyto_name LIKE ?
             ORDER BY p.phyto_name ASC
             LIMIT ?
@@ -689,6 +1185,41 @@ def api_search_phytochemicals():
 # Detail Pages
 # -------------------------
 
+def _templates_stamp() -> str:
+    """Template mtimes, so a deploy that only changes HTML still changes every ETag."""
+    folder = os.path.join(BASE_DIR, "templates")
+    try:
+        return ",".join(f"{n}:{os.path.getmtime(os.path.join(folder, n))}" for n in sorted(os.listdir(folder)))
+    except OSError:
+        return ""
+
+
+TEMPLATES_STAMP = _templates_stamp()
+
+
+def detail_etag(*parts) -> str:
+    """Strong ETag over everything a detail page renders from the DB."""
+    h = hashlib.blake2b(TEMPLATES_STAMP.encode("utf-8"), digest_size=16)
+    h.update(repr(parts).encode("utf-8"))
+    return h.hexdigest()
+
+
+def etag_response(etag: str, render):
+    """
+    304 (no rendering) when the client's If-None-Match already has etag,
+    else render() with the ETag attached. Browsers must revalidate every time.
+    """
+    if request.if_none_match.contains(etag):
+        resp = make_response("", 304)
+    else:
+        resp = make_response(render())
+    resp.set_etag(etag)
+    resp.cache_control.private = True
+    resp.cache_control.max_age = 0
+    resp.cache_control.must_revalidate = True
+    return resp
+
+
 @app.route("/spice/<int:spice_id>")
 def spice_detail(spice_id: int):
     spice = query_db(
@@ -701,19 +1232,20 @@ def spice_detail(spice_id: int):
 
     phytos = query_db(
         """
-        SELECT p.phyto_id, p.phyto_name, p.cid,
-               COALESCE(s.has_2d,0) AS has_2d,
-               COALESCE(s.has_3d,0) AS has_3d
+        SELECT p.phyto_id, p.phyto_name, p.cid, p.has_2d, p.has_3d
         FROM spice_phytochemicals sp
-        JOIN phytochemicals p ON p.phyto_id = sp.phyto_id
-        LEFT JOIN structures s ON s.phyto_id = p.phyto_id
+        JOIN v_phyto p ON p.phyto_id = sp.phyto_id
         WHERE sp.spice_id = ?
         ORDER BY p.phyto_name ASC
         """,
         (spice_id,),
     )
 
-    return render_template("spice_detail.html", spice=spice, phytochemicals=phytos)
+    etag = detail_etag("spice", tuple(spice), [tuple(r) for r in phytos])
+    return etag_response(
+        etag,
+        lambda: render_template("spice_detail.html", spice=spice, phytochemicals=phytos),
+    )
 
 
 def fetch_phyto_full(phyto_id: int):
@@ -721,9 +1253,8 @@ def fetch_phyto_full(phyto_id: int):
     return query_db(
         """
         SELECT p.phyto_id, p.phyto_name, p.cid,
-               COALESCE(s.has_2d,0) AS has_2d,
-               COALESCE(s.has_3d,0) AS has_3d,
-               s.sdf_2d_path, s.sdf_3d_path, s.png_2d_path,
+               p.has_2d, p.has_3d,
+               p.sdf_2d_path, p.sdf_3d_path, p.png_2d_path,
 
                d.molecular_formula,
                d.molecular_weight,
@@ -742,8 +1273,7 @@ def fetch_phyto_full(phyto_id: int):
                d.inchi,
                d.inchikey,
                d.iupac_name
-        FROM phytochemicals p
-        LEFT JOIN structures s ON s.phyto_id = p.phyto_id
+        FROM v_phyto p
         LEFT JOIN descriptors d ON d.phyto_id = p.phyto_id
         WHERE p.phyto_id = ?
         """,
@@ -758,6 +1288,8 @@ def phytochemical_detail(phyto_id: int):
     if not phyto:
         abort(404)
 
+    # mutable copy: on-demand fetches below merge what they wrote instead of re-querying
+    phyto = dict(phyto)
     cid = phyto["cid"]
 
     print("\n========== PHYTO DETAIL DEBUG ==========")
@@ -775,8 +1307,7 @@ def phytochemical_detail(phyto_id: int):
         and not phyto["png_2d_path"]
     )
     if cid and missing_all_structures:
-        fetch_structures_on_demand(phyto_id=phyto_id, cid=int(cid))
-        phyto = fetch_phyto_full(phyto_id)
+        phyto.update(fetch_structures_on_demand(phyto_id=phyto_id, cid=int(cid)))
 
     # ✅ ON-DEMAND descriptors + formats
     missing_desc = (
@@ -785,10 +1316,7 @@ def phytochemical_detail(phyto_id: int):
         or phyto["inchikey"] is None
     )
     if cid and missing_desc:
-        fetch_descriptors_from_pubchem(phyto_id=phyto_id, cid=int(cid))
-        phyto = fetch_phyto_full(phyto_id)
-
-    drug_rules = calc_druglikeness_rules(phyto) if phyto["molecular_weight"] is not None else None
+        phyto.update(fetch_descriptors_from_pubchem(phyto_id=phyto_id, cid=int(cid)) or {})
 
     spices = query_db(
         """
@@ -801,12 +1329,17 @@ def phytochemical_detail(phyto_id: int):
         (phyto_id,),
     )
 
-    return render_template(
-        "phytochemical_detail.html",
-        phyto=phyto,
-        spices=spices,
-        drug_rules=drug_rules,
-    )
+    def render():
+        drug_rules = calc_druglikeness_rules(phyto) if phyto["molecular_weight"] is not None else None
+        return render_template(
+            "phytochemical_detail.html",
+            phyto=phyto,
+            spices=spices,
+            drug_rules=drug_rules,
+        )
+
+    etag = detail_etag("phyto", tuple(phyto.items()), [tuple(r) for r in spices])
+    return etag_response(etag, render)
 
 
 # -------------------------
@@ -816,38 +1349,95 @@ def phytochemical_detail(phyto_id: int):
 @app.route("/admin/download_missing_structures")
 def admin_download_missing_structures():
     """
-    Downloads missing structures in batches.
+    Downloads missing structures (and backfills missing descriptors) in batches.
     Example:
       /admin/download_missing_structures?limit=25
     """
     limit = min(int(request.args.get("limit", 10)), 100)
 
     rows = query_db(
+        """
+        SELECT p.phyto_id, p.cid
+        FROM v_phyto p
+        WHERE p.cid IS NOT NULL
+          AND p.sdf_2d_path IS NULL AND p.sdf_3d_path IS NULL AND p.png_2d_path IS NULL
+        LIMIT ?
+        """,
+        (limit,),
+    )
+
+    # descriptors still missing for any CID (same test as phytochemical_detail)
+    desc_rows = query_db(
         """
         SELECT p.phyto_id, p.cid
         FROM phytochemicals p
-        LEFT JOIN structures s ON s.phyto_id = p.phyto_id
-        WHERE p.cid IS NOT NULL AND (
-            s.phyto_id IS NULL OR
-            (s.sdf_2d_path IS NULL AND s.sdf_3d_path IS NULL AND s.png_2d_path IS NULL)
-        )
+        LEFT JOIN descriptors d ON d.phyto_id = p.phyto_id
+        WHERE p.cid IS NOT NULL
+          AND (d.molecular_weight IS NULL OR d.smiles IS NULL OR d.inchikey IS NULL)
         LIMIT ?
         """,
         (limit,),
     )
 
+    # DOWNLOAD_WORKERS CIDs in flight at a time, each window committed as it lands,
+    # so a worker timeout mid-run keeps the rows already written.
+    # Files already on disk for these rows are left over from earlier runs: those with
+    # recorded validators are revalidated with a conditional GET, the rest are kept.
+    conn = get_db()
     done = 0
-    for r in rows:
-        fetch_structures_on_demand(int(r["phyto_id"]), int(r["cid"]))
-        done += 1
+    for start in range(0, len(rows), DOWNLOAD_WORKERS):
+        pending = [
+            (int(r["phyto_id"]), int(r["cid"]), submit_structure_downloads(int(r["cid"]), revalidate=True, pool=DOWNLOAD_POOL))
+            for r in rows[start:start + DOWNLOAD_WORKERS]
+        ]
+        results = [
+            (phyto_id, cid, tuple(f.result() for f in futures))
+            for phyto_id, cid, futures in pending
+        ]
+
+        conn.execute("BEGIN")
+        conn.executemany(STRUCTURES_UPSERT_SQL, [
+            structure_params(phyto_id, cid, *got)
+            for phyto_id, cid, got in results
+            if any(got)
+        ])
+        conn.commit()
+        done += len(results)
+
+    described = fetch_descriptors_bulk([(r["phyto_id"], r["cid"]) for r in desc_rows])
 
-    return jsonify({"downloaded": done, "requested": limit})
+    return jsonify({"downloaded": done, "descriptors": described, "requested": limit})
 
 @app.route("/contact")
 def contact():
     return render_template("contact.html")
 
 
+# -------------------------
+# Static structure files
+# -------------------------
+
+# CID_*.sdf / CID_*.png rarely change, but revalidated downloads and
+# download_structures.py --mode all replace them in place at the same URL.
+# Flask's static route already sends an ETag (mtime + size + name) and answers
+# If-None-Match with 304; this lets browsers skip that round trip for a day.
+# Only found files are cached: a 404 must not outlive the on-demand download.
+STRUCTURE_FILES_MAX_AGE = 86400
+
+
+@app.after_request
+def cache_structure_files(response):
+    if (
+        request.endpoint == "static"
+        and request.path.startswith("/static/structures/")
+        and response.status_code in (200, 304)
+    ):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = STRUCTURE_FILES_MAX_AGE
+    return response
+
+
 # -------------------------
 # Error Page
 # -------------------------
@@ -858,5 +1448,4 @@ def not_found(e):
 
 
 if __name__ == "__main__":
-    ensure_descriptors_table_schema()
     app.run(debug=True)
@@ -9,21 +9,101 @@ Download 2D/3D SDF and 2D PNG depictions from PubChem for phytochemicals that ha
 Usage examples:
     py -3 download_structures.py --db data/spices.db --out static/structures --limit 100
     py -3 download_structures.py --db data/spices.db --mode backfill2d
-    py -3 download_structures.py --db data/spices.db --mode all --sleep 0.3
+    py -3 download_structures.py --db data/spices.db --mode all --sleep 0.3 --workers 4
 
 Notes:
-- PubChem rate limits: this script uses delays and retries.
+- PubChem rate limits: requests run on --workers threads over one keep-alive
+  connection pool, and --sleep is the minimum gap between request starts across
+  all threads (0.25 s = 4 req/s, under PubChem's 5 req/s). 429/5xx are retried
+  with backoff.
+- 2D/3D SDFs are fetched SDF_BATCH CIDs per request (POST to the multi-CID
+  endpoint, response split on $$$$); CIDs missing from a batch response are
+  retried one by one. PNGs have no batch endpoint and stay one request per CID.
+- The pool holds at most HTTP_POOL_SIZE connections and blocks instead of
+  opening throwaway ones.
+- File writes are plain buffered 64 KiB copies into a temp file + os.replace;
+  output folders are created once up front. Writes are a small fraction of
+  run time next to the network (and the script also runs on Windows), so
+  there is no io_uring/async-file path.
 """
 
 import argparse
+import os
+import re
+import shutil
 import sqlite3
+import tempfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from urllib.error import URLError, HTTPError
-import urllib.request
+
+import urllib3
+from urllib3.util.retry import Retry
 
 PUBCHEM_BASE = "https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/CID/{cid}/{fmt}"
+PUBCHEM_SDF_BATCH = "https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/cid/SDF?record_type={record_type}"
+SDF_BATCH = 100
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) SpicesDB/1.0"
+DOWNLOAD_CHUNK = 64 * 1024
+
+# One pooled client for every worker: TCP+TLS handshakes are reused across requests
+HTTP_POOL_SIZE = 16
+HTTP = urllib3.PoolManager(
+    maxsize=HTTP_POOL_SIZE,
+    block=True,  # wait for a pooled connection rather than open+discard an extra one
+    headers={"User-Agent": USER_AGENT},
+    retries=Retry(
+        total=3, backoff_factor=1.5, status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET", "POST"],  # the batch SDF POST is a read too
+    ),
+)
+
+# WAL + NORMAL sync: periodic commits don't fsync the whole DB (WAL persists on the file)
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA foreign_keys=ON",
+)
+
+UPDATE_SQL = {
+    "2d": "UPDATE structures SET sdf_2d_path=?, has_2d=1 WHERE phyto_id=?",
+    "3d": "UPDATE structures SET sdf_3d_path=?, has_3d=1 WHERE phyto_id=?",
+    "png": "UPDATE structures SET png_2d_path=? WHERE phyto_id=?",
+}
+
+# (kind, PubChem format, output subfolder, file extension)
+KINDS = (
+    ("2d", "SDF?record_type=2d", "sdf2d", "sdf"),
+    ("3d", "SDF?record_type=3d", "sdf3d", "sdf"),
+    ("png", "PNG", "png", "png"),
+)
+
+# Per --mode row filter, so rows with nothing to do never leave SQLite
+# (same rules as the need_* checks in main)
+MODE_FILTERS = {
+    "missing": """
+        AND (COALESCE(s.sdf_2d_path, '') = ''
+             OR (COALESCE(s.sdf_3d_path, '') = '' AND s.has_3d = 1)
+             OR COALESCE(s.png_2d_path, '') = '')""",
+    "backfill2d": """
+        AND s.has_3d = 1
+        AND (COALESCE(s.sdf_2d_path, '') = '' OR COALESCE(s.png_2d_path, '') = '')""",
+    "all": "",
+}
+
+# Existing files at least this big count as done (smaller ones may be PubChem error pages)
+MIN_FILE_BYTES = 512
+
+# Buffered path updates are written in one executemany per kind once this many pile up
+FLUSH_EVERY = 200
+
+# SDF record terminator line, and the CID data item inside a PubChem record
+_SDF_END_RE = re.compile(r"^\$\$\$\$\r?$\n?", re.M)
+_SDF_CID_RE = re.compile(r"^> +<PUBCHEM_COMPOUND_CID>\r?\n(\d+)", re.M)
 
 
 # -------------------------
@@ -31,29 +111,140 @@ USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) SpicesDB/1.0"
 # -------------------------
 
 
-def download(url: str, dest: Path, retries: int = 3, timeout: int = 30) -> bool:
-    """Download URL to dest with retries."""
-    dest.parent.mkdir(parents=True, exist_ok=True)
+class RateLimiter:
+    """Spaces request starts at least `interval` seconds apart across all threads."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.next_at = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            at = max(now, self.next_at)
+            self.next_at = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
 
-    for i in range(retries):
+def save_atomic(dest: Path, write):
+    """
+    Run write(f) against a temp file next to dest, then os.replace() it into place,
+    so error pages and partial downloads never land on dest. Empty output is discarded.
+    dest's folder must exist (main creates them).
+    """
+    tmp = None
+    try:
+        with tempfile.NamedTemporaryFile(
+            "wb", dir=dest.parent, prefix=dest.name + ".", suffix=".part", delete=False
+        ) as f:
+            tmp = Path(f.name)
+            write(f)
+
+        if tmp.stat().st_size == 0:
+            raise urllib3.exceptions.HTTPError("empty response")
+
+        tmp.chmod(0o644)  # NamedTemporaryFile creates 0600
+        os.replace(tmp, dest)
+        tmp = None
+    finally:
+        if tmp is not None:
+            tmp.unlink(missing_ok=True)
+
+
+def download(url: str, dest: Path, timeout: int = 30) -> bool:
+    """Stream URL to dest in DOWNLOAD_CHUNK pieces (retries/backoff come from the HTTP pool)."""
+    try:
+        r = HTTP.request("GET", url, timeout=timeout, preload_content=False)
+        try:
+            if r.status != 200:
+                r.drain_conn()
+                raise urllib3.exceptions.HTTPError(f"HTTP {r.status}")
+            save_atomic(dest, lambda f: shutil.copyfileobj(r, f, DOWNLOAD_CHUNK))
+        finally:
+            r.release_conn()
+        return True
+
+    except (urllib3.exceptions.HTTPError, OSError) as e:
+        print(f"❌ Failed: {url} -> {dest.name} ({e})")
+        return False
+
+
+def split_sdf(text: str) -> dict:
+    """{cid: record} for a multi-record SDF (CID from the data item, else the title line)."""
+    records = {}
+    for block in _SDF_END_RE.split(text):
+        if not block.strip():
+            continue
+        m = _SDF_CID_RE.search(block)
+        title = block.split("\n", 1)[0].strip()
+        cid = int(m.group(1)) if m else int(title) if title.isdigit() else None
+        if cid is not None:
+            records[cid] = block + "$$$$\n"
+    return records
+
+
+def fetch(job: list, limiter: RateLimiter) -> list:
+    """Worker: download (phyto_id, cid, kind, url, dest) tasks in turn; returns [(task, ok)]."""
+    results = []
+    for task in job:
+        limiter.wait()
+        results.append((task, download(task[3], task[4])))
+    return results
+
+
+def fetch_sdf_batch(kind: str, job: list, limiter: RateLimiter, timeout: int = 60) -> list:
+    """
+    Worker: one POST for a batch of same-kind SDF tasks, split into per-CID files.
+    Tasks whose CID is not in the response (or a failed batch) fall back to fetch().
+    """
+    records = {}
+    limiter.wait()
+    try:
+        r = HTTP.request(
+            "POST", PUBCHEM_SDF_BATCH.format(record_type=kind), timeout=timeout,
+            fields={"cid": ",".join(str(task[1]) for task in job)}, encode_multipart=False,
+        )
+        if r.status == 200:
+            records = split_sdf(r.data.decode("utf-8", "replace"))
+    except urllib3.exceptions.HTTPError as e:
+        print(f"⚠️ SDF {kind} batch of {len(job)} failed ({e}), fetching one by one")
+
+    results, missing = [], []
+    for task in job:
+        record = records.get(task[1])
+        if record is None:
+            missing.append(task)
+            continue
         try:
-            req = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
-            with urllib.request.urlopen(req, timeout=timeout) as r:
-                data = r.read()
+            save_atomic(task[4], lambda f: f.write(record.encode("utf-8")))
+            results.append((task, True))
+        except (urllib3.exceptions.HTTPError, OSError) as e:
+            print(f"❌ Failed: write {task[4].name} ({e})")
+            results.append((task, False))
+
+    return results + fetch(missing, limiter)
 
-            if not data:
-                raise URLError("empty response")
 
-            dest.write_bytes(data)
-            return True
+def flush_updates(con: sqlite3.Connection, pending: dict) -> int:
+    """Write buffered {kind: [(rel_path, phyto_id), ...]} updates in one transaction; clears them."""
+    n = 0
+    with con:
+        for kind, params in pending.items():
+            if params:
+                con.executemany(UPDATE_SQL[kind], params)
+                n += len(params)
+                params.clear()
+    return n
 
-        except (HTTPError, URLError, TimeoutError) as e:
-            if i == retries - 1:
-                print(f"❌ Failed: {url} -> {dest.name} ({e})")
-                return False
-            time.sleep(1.5 * (i + 1))
 
-    return False
+def on_disk(dest: Path) -> bool:
+    """True if dest already holds a plausible download (e.g. from an interrupted run)."""
+    try:
+        return dest.stat().st_size > MIN_FILE_BYTES
+    except OSError:
+        return False
 
 
 def rel_to_static(dest: Path) -> str:
@@ -80,7 +271,8 @@ def main():
     ap.add_argument("--db", default="data/spices.db", help="SQLite DB path")
     ap.add_argument("--out", default="static/structures", help="Output base folder")
     ap.add_argument("--limit", type=int, default=0, help="0 means no limit")
-    ap.add_argument("--sleep", type=float, default=0.25, help="Delay between requests")
+    ap.add_argument("--sleep", type=float, default=0.25, help="Minimum delay between requests (all workers)")
+    ap.add_argument("--workers", type=int, default=8, help="Parallel download threads")
     ap.add_argument(
         "--mode",
         choices=["missing", "all", "backfill2d"],
@@ -99,32 +291,40 @@ def main():
     if not db_path.exists():
         raise FileNotFoundError(f"DB not found: {db_path}")
 
+    for _kind, _fmt, subdir, _ext in KINDS:
+        (out_dir / subdir).mkdir(parents=True, exist_ok=True)
+
     con = sqlite3.connect(db_path)
-    con.execute("PRAGMA foreign_keys=ON")
+    for pragma in SQLITE_PRAGMAS:
+        con.execute(pragma)
 
     # NOTE: some older DBs may not have a structures row for each phyto.
     # We'll join + require structures. If missing, you should create structures rows in load_data.py.
+    # --limit counts rows that still need work in this mode
     rows = con.execute(
-        """
+        f"""
         SELECT p.phyto_id, p.cid,
                COALESCE(s.has_2d, 0) as has_2d,
                COALESCE(s.has_3d, 0) as has_3d,
                COALESCE(s.sdf_2d_path,''), COALESCE(s.sdf_3d_path,''), COALESCE(s.png_2d_path,'')
         FROM phytochemicals p
         JOIN structures s ON s.phyto_id = p.phyto_id
-        WHERE p.cid IS NOT NULL
+        WHERE p.cid IS NOT NULL{MODE_FILTERS[args.mode]}
         ORDER BY p.cid
-        """
+        LIMIT ?
+        """,
+        (args.limit if args.limit and args.limit > 0 else -1,),
     ).fetchall()
 
-    if args.limit and args.limit > 0:
-        rows = rows[: args.limit]
-
-    ok2d = ok3d = okpng = 0
     attempted = 0
+    sdf_tasks = {"2d": [], "3d": []}  # batched by kind
+    png_tasks = []
+    pending = {"2d": [], "3d": [], "png": []}
+    ok = {"2d": 0, "3d": 0, "png": 0}
+    found = 0
 
     print(f"✅ Mode: {args.mode}")
-    print(f"✅ Rows with CID: {len(rows)}")
+    print(f"✅ Rows to process: {len(rows)}")
     print(f"✅ Output directory: {out_dir.resolve()}\n")
 
     for phyto_id, cid, has_2d, has_3d, sdf2d_path, sdf3d_path, png_path in rows:
@@ -147,59 +347,63 @@ def main():
             need_2d = (not sdf2d_path)
             need_png = (not png_path)
 
-        # -------------------------
-        # 2D SDF
-        # Rule: if compound has CID, we can always fetch 2D SDF.
-        # Also: if 3D exists, we still want 2D.
-        # -------------------------
-        if need_2d:
-            url = PUBCHEM_BASE.format(cid=cid, fmt="SDF?record_type=2d")
-            dest = out_dir / "sdf2d" / f"CID_{cid}.sdf"
-            if download(url, dest):
-                con.execute(
-                    "UPDATE structures SET sdf_2d_path=?, has_2d=1 WHERE phyto_id=?",
-                    (rel_to_static(dest), phyto_id),
-                )
-                ok2d += 1
-            time.sleep(args.sleep)
-
-        # -------------------------
-        # 3D SDF
-        # Rule: only attempt 3D download if has_3d is expected OR mode=all
-        # (Some CIDs may not have 3D in PubChem)
-        # -------------------------
-        if need_3d and (has_3d == 1 or force):
-            url = PUBCHEM_BASE.format(cid=cid, fmt="SDF?record_type=3d")
-            dest = out_dir / "sdf3d" / f"CID_{cid}.sdf"
-            if download(url, dest):
-                con.execute(
-                    "UPDATE structures SET sdf_3d_path=?, has_3d=1 WHERE phyto_id=?",
-                    (rel_to_static(dest), phyto_id),
-                )
-                ok3d += 1
-            time.sleep(args.sleep)
-
-        # -------------------------
-        # PNG depiction
-        # Always useful (even if only 3D exists)
-        # -------------------------
-        if need_png:
-            url = PUBCHEM_BASE.format(cid=cid, fmt="PNG")
-            dest = out_dir / "png" / f"CID_{cid}.png"
-            if download(url, dest):
-                con.execute(
-                    "UPDATE structures SET png_2d_path=? WHERE phyto_id=?",
-                    (rel_to_static(dest), phyto_id),
-                )
-                okpng += 1
-            time.sleep(args.sleep)
-
-        # commit periodically
-        if attempted % 50 == 0:
-            con.commit()
-            print(f"...progress: {attempted}/{len(rows)}")
-
-    con.commit()
+        need = {
+            # Rule: if compound has CID, we can always fetch 2D SDF.
+            # Also: if 3D exists, we still want 2D.
+            "2d": need_2d,
+            # Rule: only attempt 3D download if has_3d is expected OR mode=all
+            # (Some CIDs may not have 3D in PubChem)
+            "3d": need_3d and (has_3d == 1 or force),
+            # PNG depiction: always useful (even if only 3D exists)
+            "png": need_png,
+        }
+
+        for kind, fmt, subdir, ext in KINDS:
+            if not need[kind]:
+                continue
+            dest = out_dir / subdir / f"CID_{cid}.{ext}"
+
+            # already downloaded (DB never updated, e.g. crashed run): just record the path
+            if not force and on_disk(dest):
+                pending[kind].append((rel_to_static(dest), phyto_id))
+                found += 1
+                continue
+
+            task = (phyto_id, cid, kind, PUBCHEM_BASE.format(cid=cid, fmt=fmt), dest)
+            if kind == "png":
+                png_tasks.append(task)
+            else:
+                sdf_tasks[kind].append(task)
+
+    total = len(sdf_tasks["2d"]) + len(sdf_tasks["3d"]) + len(png_tasks)
+    print(f"✅ Already on disk: {found}")
+    print(f"✅ Downloads queued: {total} ({args.workers} workers)\n")
+
+    # Workers only download; all DB writes stay on this thread (one sqlite3 connection)
+    buffered = 0
+    limiter = RateLimiter(args.sleep)
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = [
+            pool.submit(fetch_sdf_batch, kind, tasks[i : i + SDF_BATCH], limiter)
+            for kind, tasks in sdf_tasks.items()
+            for i in range(0, len(tasks), SDF_BATCH)
+        ]
+        futures += [pool.submit(fetch, [task], limiter) for task in png_tasks]
+        for done, fut in enumerate(as_completed(futures), 1):
+            for (phyto_id, _cid, kind, _url, dest), got in fut.result():
+                if got:
+                    pending[kind].append((rel_to_static(dest), phyto_id))
+                    ok[kind] += 1
+                    buffered += 1
+
+            # flush periodically
+            if buffered >= FLUSH_EVERY:
+                flush_updates(con, pending)
+                buffered = 0
+                print(f"...progress: {done}/{len(futures)} requests")
+
+    flush_updates(con, pending)
+    ok2d, ok3d, okpng = ok["2d"], ok["3d"], ok["png"]
     con.close()
 
     print("\n✅ DONE")
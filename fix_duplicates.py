@@ -2,10 +2,36 @@ import sqlite3
 
 DB = "data/spices.db"
 
+# Lookups the merge loop runs per duplicate (structures.phyto_id is already UNIQUE);
+# idx_sp_phyto is the same index app.py creates.
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_sp_phyto ON spice_phytochemicals(phyto_id);
+CREATE INDEX IF NOT EXISTS idx_phyto_name ON phytochemicals(phyto_name);
+"""
+
+# Statement texts are reused verbatim so the connection's statement cache serves them
+SQL_GROUP_ROWS = """
+    SELECT p.phyto_id, p.cid,
+        (SELECT COUNT(*) FROM spice_phytochemicals sp WHERE sp.phyto_id=p.phyto_id) AS spice_count,
+        (SELECT COUNT(*) FROM structures s WHERE s.phyto_id=p.phyto_id) AS struct_count
+    FROM phytochemicals p
+    WHERE p.phyto_name = ?
+    ORDER BY
+        (p.cid IS NOT NULL) DESC,
+        spice_count DESC,
+        struct_count DESC
+"""
+SQL_MOVE_MAPPINGS = "UPDATE OR IGNORE spice_phytochemicals SET phyto_id = ? WHERE phyto_id = ?"
+SQL_GET_STRUCT = "SELECT * FROM structures WHERE phyto_id=?"
+SQL_MOVE_STRUCT = "UPDATE structures SET phyto_id = ? WHERE phyto_id = ?"
+SQL_DEL_STRUCT = "DELETE FROM structures WHERE phyto_id=?"
+SQL_DEL_PHYTO = "DELETE FROM phytochemicals WHERE phyto_id=?"
+
 def main():
-    conn = sqlite3.connect(DB)
+    conn = sqlite3.connect(DB, cached_statements=256)
     conn.row_factory = sqlite3.Row
     cur = conn.cursor()
+    cur.executescript(INDEXES)
 
     # Find duplicate phyto names
     dups = cur.execute("""
@@ -17,21 +43,13 @@ def main():
 
     print(f"Found {len(dups)} duplicate phytochemical names.\n")
 
+    # one transaction for all merges
+    cur.execute("BEGIN")
     for d in dups:
         name = d["phyto_name"]
 
         # all rows for this name
-        rows = cur.execute("""
-            SELECT p.phyto_id, p.cid,
-                (SELECT COUNT(*) FROM spice_phytochemicals sp WHERE sp.phyto_id=p.phyto_id) AS spice_count,
-                (SELECT COUNT(*) FROM structures s WHERE s.phyto_id=p.phyto_id) AS struct_count
-            FROM phytochemicals p
-            WHERE p.phyto_name = ?
-            ORDER BY
-                (p.cid IS NOT NULL) DESC,
-                spice_count DESC,
-                struct_count DESC
-        """, (name,)).fetchall()
+        rows = cur.execute(SQL_GROUP_ROWS, (name,)).fetchall()
 
         if len(rows) < 2:
             continue
@@ -47,32 +65,24 @@ def main():
 
         for dup_id in dup_ids:
             # Move spice mappings
-            cur.execute("""
-                UPDATE OR IGNORE spice_phytochemicals
-                SET phyto_id = ?
-                WHERE phyto_id = ?
-            """, (keeper_id, dup_id))
+            cur.execute(SQL_MOVE_MAPPINGS, (keeper_id, dup_id))
 
             # If structures exist for dup but not keeper, transfer them
-            dup_struct = cur.execute("SELECT * FROM structures WHERE phyto_id=?", (dup_id,)).fetchone()
-            keeper_struct = cur.execute("SELECT * FROM structures WHERE phyto_id=?", (keeper_id,)).fetchone()
+            dup_struct = cur.execute(SQL_GET_STRUCT, (dup_id,)).fetchone()
+            keeper_struct = cur.execute(SQL_GET_STRUCT, (keeper_id,)).fetchone()
 
             if dup_struct and not keeper_struct:
-                cur.execute("""
-                    UPDATE structures
-                    SET phyto_id = ?
-                    WHERE phyto_id = ?
-                """, (keeper_id, dup_id))
+                cur.execute(SQL_MOVE_STRUCT, (keeper_id, dup_id))
 
             # Delete dup structures (if still any)
-            cur.execute("DELETE FROM structures WHERE phyto_id=?", (dup_id,))
+            cur.execute(SQL_DEL_STRUCT, (dup_id,))
 
             # Delete duplicate phytochemical row
-            cur.execute("DELETE FROM phytochemicals WHERE phyto_id=?", (dup_id,))
+            cur.execute(SQL_DEL_PHYTO, (dup_id,))
 
-        conn.commit()
         print("   ✅ merged\n")
 
+    conn.commit()
     conn.close()
     print("✅ All duplicates processed successfully.")
 
@@ -2,8 +2,18 @@ import pandas as pd
 import numpy as np
 import re
 import sqlite3
+from functools import lru_cache
 from pathlib import Path
 
+# Rust-based XLSX reader (much faster than openpyxl); pandas' default engine otherwise.
+# Optional loader-only dependency, kept out of requirements.txt (the web app never reads
+# the workbook): pip install python-calamine
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = None
+
 # =========================
 # Paths
 # =========================
@@ -11,39 +21,51 @@ XLSX = "/mnt/data/SPICES DATABASE.xlsx"
 DB   = "/mnt/data/spices.db"
 
 TRUE_SET = {"yes", "y", "1", "true", "-"}
+CID_NULLS = {"na", "nil", "-", ""}
+
+_WS_RE = re.compile(r"\s+")
+# hidden unicode/whitespace junk seen in Excel headers
+_UNICODE_JUNK = str.maketrans({"\ufeff": "", "\u200b": "", "\xa0": " "})
+
+# WAL + NORMAL sync: commits no longer fsync the whole DB (WAL persists on the file)
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA foreign_keys=ON",
+)
 
 # =========================
 # Helpers
 # =========================
 
+@lru_cache(maxsize=4096)
 def norm_col(c: str) -> str:
+    # column headers repeat across sheets, so most calls are cache hits
     c = "" if c is None else str(c)
-    c = re.sub(r"\s+", " ", c).strip().lower()
-    return c
-
-def clean_name(x):
-    if pd.isna(x):
-        return None
-    x = str(x).strip()
-    x = re.sub(r"\s+", " ", x)
-    return x if x else None
-
-def to_bool(x) -> int:
-    if pd.isna(x):
-        return 0
-    s = str(x).strip().lower()
-    return 1 if s in TRUE_SET else 0
-
-def parse_cid(v):
-    if pd.isna(v):
-        return None
-    s = str(v).strip()
-    if s.lower() in {"na", "nil", "-", ""}:
-        return None
-    try:
-        return int(float(s))
-    except Exception:
-        return None
+    return _WS_RE.sub(" ", c.translate(_UNICODE_JUNK)).strip().lower()
+
+# Vectorized cell cleaning: whole columns via pandas .str ops, no per-cell Python calls
+
+def clean_names(col: pd.Series) -> pd.Series:
+    """Trim + collapse whitespace; blank/NaN -> None."""
+    col = col.astype("string").str.strip().str.replace(_WS_RE, " ", regex=True)
+    col = col.mask(col == "")
+    return col.astype(object).where(col.notna(), None)
+
+def to_bools(col: pd.Series) -> pd.Series:
+    """1 if the cell is in TRUE_SET (case/space-insensitive), else 0."""
+    return col.astype("string").str.strip().str.lower().isin(TRUE_SET).astype("int8")
+
+def parse_cids(col: pd.Series) -> pd.Series:
+    """Integer CIDs (truncating '123.0'); NA/nil/-/blank/garbage -> <NA> (Int64)."""
+    col = col.astype("string").str.strip()
+    col = col.mask(col.str.lower().isin(CID_NULLS))
+    num = pd.to_numeric(col, errors="coerce")
+    num = num.mask(num.abs() == np.inf)
+    return np.trunc(num).astype("Int64")
 
 # =========================
 # Column mapping (clean)
@@ -90,26 +112,13 @@ COLMAP = {
 REQUIRED_COLS = ["spice_name", "botanical_name", "phyto_name", "cid", "has_2d", "has_3d"]
 
 def unify_columns(df: pd.DataFrame) -> pd.DataFrame:
-    # remove "Unnamed" columns
-    keep_cols = [c for c in df.columns if not norm_col(c).startswith("unnamed")]
-    df = df.loc[:, keep_cols]
-
-    new_cols = []
-    for c in df.columns:
-        key = norm_col(c)
-
-        # handle hidden unicode/whitespace junk robustly
-        key = (
-            key.replace("\ufeff", "")
-               .replace("\u200b", "")
-               .replace("\xa0", " ")
-        )
-        key = re.sub(r"\s+", " ", key).strip()
-
-        mapped = COLMAP.get(key, key)
-        new_cols.append(mapped)
-
-    df.columns = new_cols
+    # header -> canonical name in one pass, dropping "Unnamed" columns
+    names = {
+        c: COLMAP.get(key, key)
+        for c in df.columns
+        if not (key := norm_col(c)).startswith("unnamed")
+    }
+    df = df.loc[:, list(names)].rename(columns=names)
 
     missing = [c for c in REQUIRED_COLS if c not in df.columns]
     if missing:
@@ -122,7 +131,8 @@ def unify_columns(df: pd.DataFrame) -> pd.DataFrame:
 # =========================
 
 def ensure_schema(con: sqlite3.Connection):
-    con.execute("PRAGMA foreign_keys=ON")
+    for pragma in SQLITE_PRAGMAS:
+        con.execute(pragma)
 
     # spices
     con.execute("""
@@ -208,98 +218,99 @@ def load():
         # will create new db
         db_path.parent.mkdir(parents=True, exist_ok=True)
 
-    con = sqlite3.connect(str(db_path))
+    # autocommit mode: the bulk load below runs in one explicit transaction
+    con = sqlite3.connect(str(db_path), isolation_level=None, cached_statements=256)
     con.row_factory = sqlite3.Row
     ensure_schema(con)
 
-    xl = pd.ExcelFile(str(xlsx_path))
-    print("Sheets:", xl.sheet_names)
+    # parse the whole workbook once: {sheet_name: DataFrame}
+    sheets = pd.read_excel(str(xlsx_path), sheet_name=None, engine=EXCEL_ENGINE)
+    print("Sheets:", list(sheets))
 
     # prepared SQL (fast, safe)
     sql_ins_spice = "INSERT OR IGNORE INTO spices(spice_name, botanical_name) VALUES (?, ?)"
-    sql_get_spice_id = "SELECT spice_id FROM spices WHERE spice_name = ?"
 
     sql_ins_phyto_cid = "INSERT OR IGNORE INTO phytochemicals(phyto_name, cid) VALUES (?, ?)"
-    sql_get_phyto_by_cid = "SELECT phyto_id, phyto_name FROM phytochemicals WHERE cid = ?"
+    sql_fix_phyto_name = """
+        UPDATE phytochemicals SET phyto_name = ?
+        WHERE cid = ? AND TRIM(COALESCE(phyto_name, '')) = ''
+    """
 
     sql_ins_phyto_null = "INSERT INTO phytochemicals(phyto_name, cid) VALUES (?, NULL)"
-    sql_last_id = "SELECT last_insert_rowid()"
 
     sql_map = "INSERT OR IGNORE INTO spice_phytochemicals(spice_id, phyto_id) VALUES (?, ?)"
 
-    sql_ins_struct = "INSERT OR IGNORE INTO structures(phyto_id, has_2d, has_3d) VALUES (?, ?, ?)"
-    sql_upd_struct = """
-        UPDATE structures
-        SET has_2d = MAX(has_2d, ?),
-            has_3d = MAX(has_3d, ?)
-        WHERE phyto_id = ?
+    # flags only ever go 0 -> 1 (also when reloading into an existing DB)
+    sql_upsert_struct = """
+        INSERT INTO structures(phyto_id, has_2d, has_3d) VALUES (?, ?, ?)
+        ON CONFLICT(phyto_id) DO UPDATE SET
+            has_2d = MAX(COALESCE(structures.has_2d, 0), excluded.has_2d),
+            has_3d = MAX(COALESCE(structures.has_3d, 0), excluded.has_3d)
     """
 
-    total_rows = 0
-    inserted_links = 0
-
-    for sheet in xl.sheet_names:
-        raw = pd.read_excel(str(xlsx_path), sheet_name=sheet)
+    # clean every sheet first, then load all rows in bulk
+    frames = []
+    for raw in sheets.values():
         df = unify_columns(raw)
 
-        df["spice_name"] = df["spice_name"].map(clean_name)
-        df["botanical_name"] = df["botanical_name"].map(clean_name)
-        df["phyto_name"] = df["phyto_name"].map(clean_name)
-        df["has_2d"] = df["has_2d"].map(to_bool)
-        df["has_3d"] = df["has_3d"].map(to_bool)
-        df["cid"] = df["cid"].map(parse_cid)
+        df["spice_name"] = clean_names(df["spice_name"])
+        df["botanical_name"] = clean_names(df["botanical_name"])
+        df["phyto_name"] = clean_names(df["phyto_name"])
+        df["has_2d"] = to_bools(df["has_2d"])
+        df["has_3d"] = to_bools(df["has_3d"])
+        df["cid"] = parse_cids(df["cid"])
 
         # drop invalid
-        df = df.dropna(subset=["spice_name", "phyto_name"])
-        total_rows += len(df)
-
-        for r in df.itertuples(index=False):
-            spice = r.spice_name
-            bot = r.botanical_name
-            phyto = r.phyto_name
-            cid = r.cid
-            has_2d = int(r.has_2d)
-            has_3d = int(r.has_3d)
-
-            # spices
-            con.execute(sql_ins_spice, (spice, bot))
-            spice_id = con.execute(sql_get_spice_id, (spice,)).fetchone()[0]
-
-            # phytochemicals: prefer CID-based UNIQUE
-            if cid is not None:
-                con.execute(sql_ins_phyto_cid, (phyto, int(cid)))
-
-                row = con.execute(sql_get_phyto_by_cid, (int(cid),)).fetchone()
-                if row is None:
-                    # very rare fallback
-                    con.execute(sql_ins_phyto_cid, (phyto, int(cid)))
-                    row = con.execute(sql_get_phyto_by_cid, (int(cid),)).fetchone()
-
-                phyto_id = row[0]
-
-                # if name missing, update it
-                if row[1] is None or str(row[1]).strip() == "":
-                    con.execute("UPDATE phytochemicals SET phyto_name=? WHERE phyto_id=?", (phyto, phyto_id))
-
-            else:
-                # no CID: each row becomes unique phyto entry (as per your original behavior)
-                con.execute(sql_ins_phyto_null, (phyto,))
-                phyto_id = con.execute(sql_last_id).fetchone()[0]
-
-            # mapping spice <-> phytochemical
-            con.execute(sql_map, (spice_id, phyto_id))
-            inserted_links += 1
-
-            # structures
-            con.execute(sql_ins_struct, (phyto_id, has_2d, has_3d))
-            con.execute(sql_upd_struct, (has_2d, has_3d, phyto_id))
-
-        con.commit()
-
-    spices = con.execute("SELECT COUNT(*) FROM spices").fetchone()[0]
-    phy = con.execute("SELECT COUNT(*) FROM phytochemicals").fetchone()[0]
-    links = con.execute("SELECT COUNT(*) FROM spice_phytochemicals").fetchone()[0]
-    withcid = con.execute("SELECT COUNT(*) FROM phytochemicals WHERE cid IS NOT NULL").fetchone()[0]
+        frames.append(df.dropna(subset=["spice_name", "phyto_name"]))
+
+    df = pd.concat(frames, ignore_index=True)
+    total_rows = len(df)
+    has_cid = df["cid"].notna()
+
+    con.execute("BEGIN IMMEDIATE")
+
+    # spices (first botanical name per spice wins, as with row-by-row INSERT OR IGNORE)
+    spices = df.drop_duplicates("spice_name")
+    con.executemany(sql_ins_spice, zip(spices["spice_name"], spices["botanical_name"]))
+    spice_ids = {name: sid for sid, name in con.execute("SELECT spice_id, spice_name FROM spices")}
+
+    # phytochemicals: prefer CID-based UNIQUE (first name per CID wins)
+    phytos = df[has_cid].drop_duplicates("cid")
+    phyto_rows = [(name, int(cid)) for name, cid in zip(phytos["phyto_name"], phytos["cid"])]
+    con.executemany(sql_ins_phyto_cid, phyto_rows)
+    # if name missing on an existing row, update it
+    con.executemany(sql_fix_phyto_name, phyto_rows)
+    phyto_ids = {
+        cid: pid
+        for pid, cid in con.execute("SELECT phyto_id, cid FROM phytochemicals WHERE cid IS NOT NULL")
+    }
+
+    # no CID: each row becomes unique phyto entry (as per your original behavior)
+    null_ids = []
+    for phyto in df.loc[~has_cid, "phyto_name"]:
+        null_ids.append(con.execute(sql_ins_phyto_null, (phyto,)).lastrowid)
+
+    df["spice_id"] = df["spice_name"].map(spice_ids)
+    null_ids = pd.Series(null_ids, index=df.index[~has_cid], dtype="int64")
+    df["phyto_id"] = df["cid"].map(phyto_ids).fillna(null_ids).astype("int64")
+
+    # mapping spice <-> phytochemical
+    links = df[["spice_id", "phyto_id"]].astype(int)
+    con.executemany(sql_map, links.itertuples(index=False, name=None))
+
+    # structures: one row per phyto_id with the max flags over all its source rows
+    flags = df.groupby("phyto_id", sort=False)[["has_2d", "has_3d"]].max().astype(int)
+    con.executemany(sql_upsert_struct, flags.itertuples(name=None))
+
+    con.execute("COMMIT")
+
+    # one statement = one consistent snapshot for all four counts
+    spices, phy, links, withcid = con.execute("""
+        SELECT (SELECT COUNT(*) FROM spices),
+               (SELECT COUNT(*) FROM phytochemicals),
+               (SELECT COUNT(*) FROM spice_phytochemicals),
+               (SELECT COUNT(*) FROM phytochemicals WHERE cid IS NOT NULL)
+    """).fetchone()
 
     con.close()
 